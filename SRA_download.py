@@ -2,11 +2,12 @@
 SRA_download.py
 This script is an CLI for downloading fastq files from NCBI SRA using the SRA_download_lib.py library. 
 Downloads fastq files for the list of samples in parallel using multiple download methods.
-Requires joblib, kingfisher and Aspera Client  to be installed.
+Requires kingfisher and Aspera Client  to be installed.
 """
 
 from SRA_download_lib import download_fastq_parallel
 import argparse
+import sys
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-I", "--input_file")  # path to .txt file with sample ids
@@ -18,8 +19,8 @@ parser.add_argument(
     "-P", "--processes", type=int, default=10
 )  # number of parallel downloads (recommended 10 as is the maximum simultaneuous request by NCBI)
 parser.add_argument(
-    "-M", "--use_max_processes", type=bool, default=False
-)  # use maximum parallel downloads (occupy all cores)
+    "-M", "--use_max_processes", action=argparse.BooleanOptionalAction, default=False
+)  # use maximum parallel downloads (capped at the number of cores and the NCBI limit of 10)
 args = vars(parser.parse_args())
 
 file, out_dir, download_methods, processes, use_max_processes = (
@@ -30,10 +31,21 @@ file, out_dir, download_methods, processes, use_max_processes = (
     args["use_max_processes"],
 )
 
-download_fastq_parallel(
+results = download_fastq_parallel(
     out_dir=out_dir,
     download_methods=download_methods,
     processes=processes,
     file=file,
     use_max_processes=use_max_processes,
 )
+
+# Exits with an error if any kingfisher call failed.
+failed = [
+    sample_id
+    for sample_ids, returncode, _ in results
+    if returncode != 0
+    for sample_id in sample_ids
+]
+if failed:
+    print(f"Failed samples: {' '.join(failed)}", file=sys.stderr)
+    sys.exit(1)
@@ -3,8 +3,209 @@ SRA_download_lib.py
 Contains functions for downloading data from the Sequence Read Archive (SRA).
 """
 
+import asyncio
+import codecs
+import dbm
+import json
 import os
+import pickle
 import re
+import shelve
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Optional dependencies are imported once here. If one is missing, the error is raised
+# only when a function that needs it is called (see _require).
+try:
+    import GEOparse
+except ImportError:
+    GEOparse = None
+
+try:
+    from pysradb import SRAweb
+except ImportError:
+    SRAweb = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+try:
+    import aiofiles
+    import aiohttp
+except ImportError:
+    aiofiles = aiohttp = None
+
+ENA_FILEREPORT_URL = "https://www.ebi.ac.uk/ena/portal/api/filereport"
+# Maximum number of simultaneous requests allowed by NCBI.
+NCBI_MAX_CONCURRENT = 10
+# NCBI E-utilities requests per second allowed without and with an API key.
+NCBI_RATE_LIMIT = 3
+NCBI_RATE_LIMIT_API_KEY = 10
+# Approximate number of E-utilities requests made by each pysradb metadata lookup.
+NCBI_REQUESTS_PER_LOOKUP = 3
+# Name of the per-batch results report written to the output directory by download_fastq_parallel.
+DOWNLOAD_REPORT_NAME = "_download_report.jsonl"
+# Disk cache of GSM lookups, so repeated runs of the same dataset skip the NCBI queries.
+GSM_CACHE_PATH = os.path.expanduser("~/.cache/sra_download/gsm.db")
+
+# pysradb metadata columns stored for each GSM, so one query serves both gsm_to_srr and gsm_to_srp.
+GSM_CACHED_COLUMNS = ("run_accession", "study_accession")
+# Errors that make the disk cache unusable. dbm.error also includes OSError.
+_SHELF_ERRORS = (*dbm.error, pickle.UnpicklingError, EOFError)
+
+_gsm_cache = {}
+_gsm_cache_lock = threading.Lock()
+_ncbi_lock = threading.Lock()
+_ncbi_next_time = 0.0
+
+
+def _require(module, name: str) -> None:
+    """
+    Raise an ImportError if an optional dependency could not be imported.
+    """
+    if module is None:
+        raise ImportError(f"{name} is required for this function. Please install it.")
+
+
+def _read_ids(path: str) -> list:
+    """
+    Read sample ids from a .txt file with one id per line, skipping blank lines.
+    """
+    with open(path, "r") as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def _tee_stderr(stream, maxlen: int = 10) -> str:
+    """
+    Echo a subprocess stderr stream to sys.stderr unchanged as it arrives, and return its last lines.
+    Progress bars redrawn with "\r" are passed through as is, but only the last redraw of each
+    "\n"-terminated line is kept, so they do not push the actual messages out of the tail.
+    """
+    tail = deque(maxlen=maxlen)
+    out = getattr(sys.stderr, "buffer", None)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = b""
+
+    def keep(line):
+        line = line.rstrip(b"\r").rsplit(b"\r", 1)[-1]
+        if line.strip():
+            tail.append(line.decode(errors="replace"))
+
+    while data := stream.read1(65536):
+        # Notebooks replace sys.stderr with a text-only stream.
+        if out is not None:
+            out.write(data)
+            out.flush()
+        else:
+            sys.stderr.write(decoder.decode(data))
+        *lines, pending = (pending + data).split(b"\n")
+        for line in lines:
+            keep(line)
+        # Bounds the memory used by a line that is only ever redrawn.
+        pending = pending[-65536:]
+    keep(pending)
+    return "\n".join(tail)
+
+
+def _wait_for_ncbi(api_key: str = None) -> None:
+    """
+    Block until a new metadata lookup can be sent without exceeding the NCBI rate limit.
+    Shared by all threads.
+    """
+    global _ncbi_next_time
+
+    rate = NCBI_RATE_LIMIT_API_KEY if api_key else NCBI_RATE_LIMIT
+    with _ncbi_lock:
+        now = time.monotonic()
+        wait = _ncbi_next_time - now
+        _ncbi_next_time = max(now, _ncbi_next_time) + NCBI_REQUESTS_PER_LOOKUP / rate
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _is_missing(value) -> bool:
+    """
+    Return True if a metadata value is missing (None, NaN, NA or empty).
+    """
+    if pandas is not None:
+        if pandas.isna(value):
+            return True
+    elif value != value:
+        return True
+    return value is None or not str(value).strip()
+
+
+def _gsm_lookup(gsm: str, column: str, sra_db=None, api_key: str = None) -> str:
+    """
+    Return the value of a pysradb metadata column for a GSM, using the in-memory and disk caches.
+    All GSM_CACHED_COLUMNS are cached from a single query. Queries to NCBI are rate limited.
+    Returns None if the value is missing.
+    """
+    with _gsm_cache_lock:
+        if column in _gsm_cache.get(gsm, {}):
+            return _gsm_cache[gsm][column]
+        # The disk cache is best-effort: if it cannot be used (e.g. read-only home or corrupt
+        # file), the lookup goes to NCBI.
+        try:
+            os.makedirs(os.path.dirname(GSM_CACHE_PATH), exist_ok=True)
+            with shelve.open(GSM_CACHE_PATH) as shelf:
+                if column in shelf.get(gsm, {}):
+                    _gsm_cache[gsm] = shelf[gsm]
+                    return _gsm_cache[gsm][column]
+        except _SHELF_ERRORS:
+            pass
+
+    if sra_db is None:
+        _require(SRAweb, "pysradb")
+        sra_db = SRAweb(api_key=api_key)
+    _wait_for_ncbi(api_key)
+    sample_metadata = sra_db.sra_metadata(gsm)
+
+    # Missing values are not cached.
+    record = {}
+    for name in {column, *GSM_CACHED_COLUMNS}:
+        try:
+            value = sample_metadata.at[0, name]
+        except KeyError:
+            continue
+        if not _is_missing(value):
+            record[name] = str(value)
+
+    with _gsm_cache_lock:
+        record = {**_gsm_cache.get(gsm, {}), **record}
+        _gsm_cache[gsm] = record
+        try:
+            with shelve.open(GSM_CACHE_PATH) as shelf:
+                shelf[gsm] = record
+        except _SHELF_ERRORS:
+            pass
+    return record.get(column)
+
+
+def _clean_ids(sample_ids: list) -> list:
+    """
+    Remove duplicated and malformed run accessions (SRR, ERR or DRR) from a list of sample ids.
+    Returns the remaining ids sorted.
+    """
+    valid_ids = [
+        sample_id
+        for sample_id in sample_ids
+        if isinstance(sample_id, str) and re.fullmatch(r"[SED]RR\d+", sample_id)
+    ]
+    unique_ids = sorted(set(valid_ids))
+
+    malformed = len(sample_ids) - len(valid_ids)
+    duplicated = len(valid_ids) - len(unique_ids)
+    if malformed or duplicated:
+        print(f"Dropped {malformed} malformed and {duplicated} duplicated sample ids.")
+    return unique_ids
 
 
 def get_GEO_info(GEO_id: str) -> dict:
@@ -12,7 +213,7 @@ def get_GEO_info(GEO_id: str) -> dict:
     Retrieve GEO information for the given GEO ID and return it as a dictionary.
     Requires the GEOparse package to be installed.
     """
-    import GEOparse
+    _require(GEOparse, "GEOparse")
 
     # Geoparse searchs for the accession number and generates a GSE object containing all the information.
     gse = GEOparse.get_GEO(GEO_id)
@@ -70,58 +271,55 @@ def show_GPL_info(gse):
         break
 
 
-def list_to_dict(list: list, split: str = ":") -> dict:
+def list_to_dict(strings: list, split: str = ":") -> dict:
     """
-    Convert a list of strings into a dictionary by splitting each string at a specified character.
+    Convert a list of strings into a dictionary by splitting each string at the first occurrence of a specified character.
 
     Args:
-        list: list of strings to convert into key-value pairs
+        strings: list of strings to convert into key-value pairs
         split: character to split each string in the list (default is ':')
 
     Returns:
         dict: dictionary containing key-value pairs from the input list
     """
-    dict = {key: value for key, value in [pair.split(split) for pair in list]}
-    return dict
+    return {key: value for key, _, value in (pair.partition(split) for pair in strings)}
 
 
-def gsm_to_srr(gsm: str) -> str:
+def gsm_to_srr(gsm: str, sra_db=None, api_key: str = None) -> str:
     """
     Convert a Gene Expression Omnibus (GEO) Sample accession (GSM) to Sequence Read Archive (SRA) run accession (SRR).
+    Results are cached in memory and on disk (GSM_CACHE_PATH).
     Requires the pysradb package to be installed.
 
     Args:
         gsm (str): The Gene Expression Omnibus Sample accession (GSM) to be converted.
+        sra_db (SRAweb, optional): SRAweb instance to reuse between calls, so its HTTP connection is kept alive. A new one is created if None.
+        api_key (str, optional): NCBI API key (the same one given to sra_db). Raises the request rate limit from 3 to 10 per second.
 
     Returns:
-        str: The Sequence Read Archive run accession (SRR) corresponding to the input GSM.
+        str: The Sequence Read Archive run accession (SRR) corresponding to the input GSM, or None if it is missing.
     """
 
-    from pysradb import SRAweb
-
-    sra_db = SRAweb()
-    sample_metadata = sra_db.sra_metadata(gsm)
-    srr = sample_metadata.at[0, "run_accession"]
+    srr = _gsm_lookup(gsm, "run_accession", sra_db, api_key)
     return srr
 
 
-def gsm_to_srp(gsm: str) -> str:
+def gsm_to_srp(gsm: str, sra_db=None, api_key: str = None) -> str:
     """
     Convert a Gene Expression Omnibus (GEO) Sample accession (GSM) to Sequence Read Archive (SRA) project accession (SRP).
+    Results are cached in memory and on disk (GSM_CACHE_PATH).
     Requires the pysradb package to be installed.
 
     Args:
         gsm (str): The Gene Expression Omnibus Sample accession (GSM) to be converted.
+        sra_db (SRAweb, optional): SRAweb instance to reuse between calls, so its HTTP connection is kept alive. A new one is created if None.
+        api_key (str, optional): NCBI API key (the same one given to sra_db). Raises the request rate limit from 3 to 10 per second.
 
     Returns:
-        srp: The Sequence Read Archive run accession (SRP) corresponding to the input GSM.
+        srp: The Sequence Read Archive run accession (SRP) corresponding to the input GSM, or None if it is missing.
     """
 
-    from pysradb import SRAweb
-
-    sra_db = SRAweb()
-    sample_metadata = sra_db.sra_metadata(gsm)
-    srp = sample_metadata.at[0, "study_accession"]
+    srp = _gsm_lookup(gsm, "study_accession", sra_db, api_key)
     return srp
 
 
@@ -130,9 +328,10 @@ def download_fastq(
     sample_ids: str | list = None,
     download_methods: str = "ena-ascp ena-ftp aws-http prefetch",
     file=None,
-) -> None:
+) -> tuple:
     """
     Downloads fastq files for the given sample ids using different download methods.
+    Duplicated ids and ids that are not run accessions (SRR, ERR or DRR) are dropped from the file.
     Requires kingfisher and Aspera Client to be installed.
 
     Args:
@@ -142,25 +341,48 @@ def download_fastq(
         file = path to .txt file with sample ids. Each sample id should be on a separate line. If file, sample_list will be ignored.
 
     Returns:
-        None
+        tuple: (sample_ids, returncode, stderr_tail) with the list of sample ids, the kingfisher exit code and the last lines of its error output.
     """
-    import subprocess
-
     if file:
-        with open(file, "r") as file:
-            sample_ids = [line.strip() for line in file.readlines()]
+        sample_ids = _clean_ids(_read_ids(file))
 
     if sample_ids.__class__ == list:
         sample_ids = " ".join(sample_ids)
 
     # In order to use current directory, --output-directory is not required.
-    out_dir_parser = f"--output-directory {out_dir}" if out_dir else ""
-
-    # Calls kingfisher to download fastq files.
-    subprocess.call(
-        f"kingfisher get --run-identifiers {sample_ids} {out_dir_parser} --download-methods {download_methods}",
-        shell=True,
-    )
+    # "~" is expanded here, since kingfisher is no longer run through a shell.
+    out_dir_parser = ["--output-directory", os.path.expanduser(out_dir)] if out_dir else []
+
+    # Calls kingfisher to download fastq files. The argument list is passed directly (no shell).
+    # subprocess only uses posix_spawn (instead of fork) with an absolute executable path and
+    # close_fds=False. Leaving fds open is safe: Python creates them non-inheritable by default.
+    cmd = [
+        shutil.which("kingfisher") or "kingfisher",
+        "get",
+        "--run-identifiers",
+        *sample_ids.split(),
+        *out_dir_parser,
+        "--download-methods",
+        *download_methods.split(),
+    ]
+    # kingfisher logs to stderr: it is echoed as it arrives and only the last lines are kept.
+    with subprocess.Popen(cmd, stderr=subprocess.PIPE, close_fds=False) as process:
+        stderr_tail = _tee_stderr(process.stderr)
+        returncode = process.wait()
+    return sample_ids.split(), returncode, stderr_tail
+
+
+def _download_batch(out_dir: str, sample_ids: list, download_methods: str) -> list:
+    """
+    Download a batch of samples with a single kingfisher call and return a list of download_fastq results.
+    kingfisher stops at the first run it cannot download, so the runs after it are never tried.
+    When the batch fails, each of its runs is retried on its own to get a per-sample status
+    (runs already downloaded are skipped by kingfisher).
+    """
+    result = download_fastq(out_dir, sample_ids, download_methods)
+    if result[1] != 0 and len(sample_ids) > 1:
+        return [download_fastq(out_dir, [sample_id], download_methods) for sample_id in sample_ids]
+    return [result]
 
 
 def download_fastq_parallel(
@@ -170,10 +392,14 @@ def download_fastq_parallel(
     processes: int = 10,
     file=None,
     use_max_processes=False,
-) -> None:
+) -> list:
     """
     Download fastq files for a list of samples in parallel using multiple download methods.
-    Requires joblib, kingfisher and Aspera Client  to be installed.
+    Samples are split into one batch per process and each batch is downloaded by a single kingfisher call.
+    If a batch fails, its samples are retried one by one, so an unavailable run does not block the rest.
+    Downloads are I/O-bound subprocess calls, so a thread pool is used instead of worker processes.
+    Duplicated ids and ids that are not run accessions (SRR, ERR or DRR) are dropped.
+    Requires kingfisher and Aspera Client  to be installed.
 
     Parameters:
         sample_list (list): List of sample IDs to download fastq files for.
@@ -181,25 +407,205 @@ def download_fastq_parallel(
         download_methods (str): Methods to download the files (e.g., ena-ascp, ena-ftp, aws-http, prefetch).
         processes (int): Number of processes to use for parallel downloading. Default is 10.
         file = path to .txt file with sample ids. Each sample id should be on a separate line. If file, sample_list will be ignored.
-        use_max_processes (bool): Flag to indicate whether to use the maximum available processes.
+        use_max_processes (bool): Flag to use one process per sample, capped at the number of cores and NCBI_MAX_CONCURRENT.
 
     Returns:
-        None
+        list: One (sample_ids, returncode, stderr_tail) tuple per kingfisher call (returncode is None if the
+        call could not be run). Failed batches are retried one sample at a time and reported per sample.
+        All results are also written as JSON lines to DOWNLOAD_REPORT_NAME in the output directory, so
+        failed samples can be retried.
     """
 
     if file:
-        with open(file, "r") as file:
-            sample_list = [line.strip() for line in file.readlines()]
+        sample_list = _read_ids(file)
 
-    from joblib import Parallel, delayed
+    sample_list = _clean_ids(sample_list)
 
     if use_max_processes:
-        processes = len(sample_list)
+        processes = max(1, min(len(sample_list), os.cpu_count() or 1, NCBI_MAX_CONCURRENT))
+
+    # Splits the samples into one batch per process, so each kingfisher call downloads several runs.
+    chunks = [sample_list[i::processes] for i in range(processes)]
+    chunks = [chunk for chunk in chunks if chunk]
+
+    with ThreadPoolExecutor(max_workers=processes) as executor:
+        futures = {
+            executor.submit(_download_batch, out_dir, chunk, download_methods): chunk
+            for chunk in chunks
+        }
+        results = []
+        for future in as_completed(futures):
+            # A batch that could not be run (e.g. kingfisher not found) is recorded as failed
+            # with a None return code, so the other batches and the report are not lost.
+            try:
+                results += future.result()
+            except Exception as error:
+                results.append((futures[future], None, repr(error)))
+
+    report_dir = os.path.expanduser(out_dir or ".")
+    os.makedirs(report_dir, exist_ok=True)
+    with open(os.path.join(report_dir, DOWNLOAD_REPORT_NAME), "w") as report:
+        for sample_ids, returncode, stderr_tail in results:
+            report.write(
+                json.dumps(
+                    {
+                        "sample_ids": sample_ids,
+                        "returncode": returncode,
+                        "stderr_tail": stderr_tail,
+                    }
+                )
+                + "\n"
+            )
+
+    return results
+
+
+async def download_fastq_ena(
+    out_dir: str,
+    sample_ids: list,
+    processes: int = 10,
+    chunk_size: int = 1024 * 1024,
+    write_buffer_size: int = 16 * 1024 * 1024,
+) -> list:
+    """
+    Coroutine that downloads fastq files directly from ENA, with many downloads in flight from a single process.
+    It can be awaited from a running event loop (e.g. in Jupyter). See download_fastq_async for a blocking
+    version that also falls back to kingfisher. Requires aiohttp and aiofiles to be installed.
 
-    Parallel(n_jobs=processes)(
-        delayed(download_fastq)(out_dir, sample_id, download_methods)
-        for sample_id in sample_list
-    )
+    Args:
+        out_dir (str): The directory to save the downloaded files. Current directory if empty.
+        sample_ids (list): The ids of the samples to download. They are used as given.
+        processes (int): Maximum number of simultaneous connections. Default is 10.
+        chunk_size (int): Size in bytes of the chunks read from the network. Default is 1 MB.
+        write_buffer_size (int): Chunks are accumulated up to this size in bytes before each write to disk. Default is 16 MB.
+
+    Returns:
+        list: The sample ids that could not be downloaded.
+    """
+    _require(aiohttp, "aiohttp")
+    _require(aiofiles, "aiofiles")
+
+    target_dir = os.path.expanduser(out_dir or ".")
+    os.makedirs(target_dir, exist_ok=True)
+
+    async def fetch_sample(session, semaphore, sample_id):
+        # Returns the sample id if the download failed, None otherwise.
+        part_path = None
+        async with semaphore:
+            try:
+                params = {
+                    "accession": sample_id,
+                    "result": "read_run",
+                    "fields": "fastq_ftp",
+                }
+                async with session.get(ENA_FILEREPORT_URL, params=params) as response:
+                    response.raise_for_status()
+                    report = await response.text()
+
+                # The report is a TSV with a header line and one line per run.
+                lines = report.strip().splitlines()
+                header = lines[0].split("\t")
+                urls = []
+                for line in lines[1:]:
+                    fastq_ftp = dict(zip(header, line.split("\t"))).get("fastq_ftp", "")
+                    urls += [url for url in fastq_ftp.split(";") if url]
+                if not urls:
+                    return sample_id
+
+                for url in urls:
+                    # Downloads to a temporary name, so an interrupted download is never left as a complete
+                    # file (kingfisher skips existing files in the fallback).
+                    path = os.path.join(target_dir, os.path.basename(url))
+                    part_path = path + ".part"
+                    async with session.get(f"https://{url}") as response:
+                        response.raise_for_status()
+                        async with aiofiles.open(part_path, "wb") as out_file:
+                            # Writes in large batches, so disk writes do not interleave with every network read.
+                            buffer = bytearray()
+                            async for chunk in response.content.iter_chunked(chunk_size):
+                                buffer += chunk
+                                if len(buffer) >= write_buffer_size:
+                                    await out_file.write(buffer)
+                                    buffer.clear()
+                            if buffer:
+                                await out_file.write(buffer)
+                    os.replace(part_path, path)
+                    part_path = None
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError, IndexError):
+                if part_path and os.path.exists(part_path):
+                    os.remove(part_path)
+                return sample_id
+            return None
+
+    async def fetch_all():
+        semaphore = asyncio.Semaphore(processes)
+        connector = aiohttp.TCPConnector(limit=processes, limit_per_host=processes)
+        # No total timeout, since a fastq can take hours to download; only stalled connections time out.
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=60, sock_read=300)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            return await asyncio.gather(
+                *[fetch_sample(session, semaphore, sample_id) for sample_id in sample_ids]
+            )
+
+    results = await fetch_all()
+    return [sample_id for sample_id in results if sample_id]
+
+
+def download_fastq_async(
+    out_dir: str,
+    sample_ids: str | list = None,
+    download_methods: str = "ena-ascp ena-ftp aws-http prefetch",
+    processes: int = 10,
+    file=None,
+    chunk_size: int = 1024 * 1024,
+    write_buffer_size: int = 16 * 1024 * 1024,
+) -> tuple:
+    """
+    Downloads fastq files directly from ENA using asyncio, with many downloads in flight from a single process.
+    Samples that fail to download are retried with kingfisher using the given download methods.
+    Duplicated ids and ids that are not run accessions (SRR, ERR or DRR) are dropped.
+    Blocks until done; it also works from a running event loop (e.g. in Jupyter), where download_fastq_ena can be awaited instead.
+    Requires aiohttp and aiofiles to be installed (and kingfisher for the fallback).
+
+    Args:
+        out_dir (str): The directory to save the downloaded files. Current directory if empty.
+        sample_ids (str | list): The ids of the samples to download. Can be a single id or a list of ids.
+        download_methods (str, optional): The kingfisher methods used for failed samples. Defaults to "ena-ascp ena-ftp aws-http prefetch".
+        processes (int): Maximum number of simultaneous connections. Default is 10.
+        file = path to .txt file with sample ids. Each sample id should be on a separate line. If file, sample_ids will be ignored.
+        chunk_size (int): Size in bytes of the chunks read from the network. Default is 1 MB.
+        write_buffer_size (int): Chunks are accumulated up to this size in bytes before each write to disk. Default is 16 MB.
+
+    Returns:
+        tuple: (failed, fallback_results) with the sample ids that could not be downloaded from ENA and the
+        list of (sample_ids, returncode, stderr_tail) results of the kingfisher fallback for them. If the
+        fallback fails, its samples are retried one by one and reported per sample.
+    """
+    _require(aiohttp, "aiohttp")
+    _require(aiofiles, "aiofiles")
+
+    if file:
+        sample_ids = _read_ids(file)
+
+    if sample_ids.__class__ == str:
+        sample_ids = sample_ids.split()
+
+    sample_ids = _clean_ids(sample_ids)
+
+    coroutine = download_fastq_ena(out_dir, sample_ids, processes, chunk_size, write_buffer_size)
+    # asyncio.run cannot be called from a running event loop (e.g. in Jupyter), so the
+    # downloads then run in their own loop in a separate thread.
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        failed = asyncio.run(coroutine)
+    else:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            failed = executor.submit(asyncio.run, coroutine).result()
+
+    # Falls back to kingfisher for the samples that could not be downloaded from ENA.
+    fallback_results = _download_batch(out_dir, failed, download_methods) if failed else []
+    return failed, fallback_results
 
 
 def download_GEO_dataset(
@@ -208,31 +614,45 @@ def download_GEO_dataset(
     download_methods: str = "ena-ascp ena-ftp aws-http prefetch",
     processes: int = 10,
     use_max_processes=False,
+    api_key: str = None,
 ) -> None:
     """
     Downloads a GEO dataset using the specified GEO ID.
-    Requires: GEOparse, pysradb, joblib, Aspera Client and kingfisher.
+    Requires: GEOparse, pysradb, Aspera Client and kingfisher.
 
     Args:
         GEO_id (str): The GEO ID of the dataset to be downloaded.
         out_dir (str, optional): The output directory for the downloaded files. Defaults to ".".
         download_methods (str, optional): The methods to be used for downloading. Defaults to "ena-ascp ena-ftp aws-http prefetch".
         processes (int, optional): The number of processes to be used for downloading. Defaults to 8.
-        use_max_processes (bool): Flag to indicate whether to use the maximum available processes.
+        use_max_processes (bool): Flag to use one process per sample, capped at the number of cores and NCBI_MAX_CONCURRENT.
+        api_key (str, optional): NCBI API key, used to look up the samples at a higher request rate.
 
     Returns:
         None
     """
 
+    _require(SRAweb, "pysradb")
+
     gse = get_GEO_info(GEO_id)
-    sample_ids = [gsm_to_srr(sample_id) for sample_id in gse.gsms.keys()]
+    # Lookups run concurrently; the NCBI request rate (3/s, or 10/s with an API key) is enforced
+    # across all threads by _wait_for_ncbi, so a slow lookup does not hold back the others.
+    # Each thread keeps its own SRAweb instance, so its connection is reused without sharing a session.
+    workers = max(1, min(NCBI_MAX_CONCURRENT, len(gse.gsms)))
+    thread_data = threading.local()
 
-    if use_max_processes:
-        processes = len(sample_ids)
+    def lookup(gsm):
+        if not hasattr(thread_data, "sra_db"):
+            thread_data.sra_db = SRAweb(api_key=api_key)
+        return gsm_to_srr(gsm, thread_data.sra_db, api_key)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        sample_ids = list(executor.map(lookup, gse.gsms.keys()))
 
     download_fastq_parallel(
         sample_list=sample_ids,
         out_dir=out_dir,
         download_methods=download_methods,
         processes=processes,
+        use_max_processes=use_max_processes,
     )